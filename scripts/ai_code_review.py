@@ -8,129 +8,497 @@ import os
 import sys
 import json
 import ast
+import hashlib
+import re
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from operator import itemgetter
 from pathlib import Path
-from huggingface_ai_helper import HuggingFaceAI
+from huggingface_ai_helper import HuggingFaceAI, HFAPIError, extract_generated_text
+from script_utils import find_python_files, iter_python_files, log, prune_cache_dir, write_json
+
+# 每次批量审查的文件数
+REVIEW_BATCH_SIZE = 8
+
+# 审查生成的token数上限；批量审查共用同一上限，避免超出托管模型的总长度限制
+REVIEW_MAX_LENGTH = 1500
+
+# 并发审查的最大线程数
+MAX_WORKERS = 8
+
+# 待审查批次队列的容量，限制查找领先审查的程度
+QUEUE_SIZE = MAX_WORKERS * 2
+
+# 审查提示中代码预览的最大字符数
+REVIEW_PREVIEW_CHARS = 2000
+
+# 超过该行数或缺少文档字符串的函数，在结构摘要中附带源码片段
+SNIPPET_MIN_LINES = 20
+SNIPPET_MAX_CHARS = 600
+# 每个文件所有源码片段的总字符预算，需小于其替代的代码预览长度
+SNIPPET_BUDGET_CHARS = 1200
+
+# 设置 HF_STREAM=1 时流式获取审查结果（需模型支持流式输出，如TGI部署的模型）
+STREAM_REVIEWS = os.getenv("HF_STREAM") == "1"
+# 流式检查问题标记时保留的上一段末尾字符数，覆盖被拆分到多个token中的标记
+STREAM_TAIL_CHARS = 8
+
+# 总结提示中最多列出的问题文件数及每个文件的审查摘录长度
+SUMMARY_MAX_FILES = 20
+SUMMARY_EXCERPT_CHARS = 300
+
+# GitHub评论的标题及审查摘录长度
+_GH_COMMENT_HEADER = "## AI代码审查发现的问题\n\n"
+GH_COMMENT_CHARS = 500
+
+# 结构分析格式版本，格式变化时使旧缓存失效
+ANALYSIS_VERSION = "4"
+
+# 审查提示的固定部分
+_REVIEW_REQUIREMENTS = """审查要求:
+1. 代码质量评估
+2. 潜在问题发现
+3. 性能优化建议
+4. 安全性检查
+5. 可读性改进
+6. 规范符合性（PEP 8）
+7. 具体修改建议"""
+
+_REVIEW_FORMAT = """- ✅ 优点
+- ⚠️  问题
+- 🔧 建议
+- 📝 具体修改"""
+
+_REVIEW_FOCUS = """针对风荷载计算项目的特殊性，请特别关注：
+- 数值计算准确性
+- 错误处理完整性
+- 文档完整性
+- 工程应用可靠性"""
+
+_PROMPT_PREFIX = "请根据以下Python代码结构摘要进行专业代码审查：\n\n"
+_PROMPT_SUFFIX = f"""
+
+{_REVIEW_REQUIREMENTS}
+
+请用中文回复，格式：
+{_REVIEW_FORMAT}
+
+{_REVIEW_FOCUS}"""
+
+_BATCH_PROMPT_PREFIX = "请根据代码结构摘要依次审查以下 {count} 个Python文件，用 '===FILE i===' 分隔输出每个文件的审查结果（i 为文件序号）。\n\n"
+_BATCH_PROMPT_SUFFIX = f"""{_REVIEW_REQUIREMENTS}
+
+请用中文回复，每个文件的格式：
+===FILE i===
+{_REVIEW_FORMAT}
+
+{_REVIEW_FOCUS}"""
+
+# 跨运行的持久缓存：内容哈希 -> 结构分析 / AI审查文本
+CACHE_DIR = Path(".cache")
+ANALYSIS_CACHE_FILE = CACHE_DIR / "ast_analysis.json"
+REVIEW_CACHE_DIR = CACHE_DIR / "ai_reviews"
+
+# 审查提示版本，修改提示内容时递增以使审查缓存失效
+PROMPT_VERSION = "v3"
+
+_analysis_cache = {}
+# 本次运行用到的分析缓存键，保存时只保留这些条目，避免缓存无限增长
+_used_analysis_keys = set()
+# 本次运行用到的审查缓存键，结束时删除其余缓存文件
+_used_review_keys = set()
+_cache_lock = threading.Lock()
+
+# 模型未按分隔符输出批量审查时置位，此后改为逐个文件审查
+_batching_disabled = threading.Event()
+
+# 批量审查响应中的文件分隔符，如 ===FILE 1===
+_FILE_DELIMITER_RE = re.compile(r"===\s*FILE\s+(\d+)\s*===")
 
 def find_changed_files():
     """查找更改的文件（用于PR审查）"""
     # 这里简化处理，审查所有Python文件
     return find_python_files("src")
 
-def find_python_files(directory="src"):
-    """查找Python文件"""
-    python_files = []
+def review_cache_key(ai_helper, content):
+    """审查缓存键：提示版本、模型和文件内容共同决定"""
+    raw = "\n".join([PROMPT_VERSION, ai_helper.model, content])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def content_hash(content):
+    """计算文件内容哈希，作为缓存键"""
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+def load_json_cache(cache_file):
+    """读取JSON缓存文件，不存在或损坏时返回空字典"""
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_json_cache(cache_file, data):
+    """保存JSON缓存文件"""
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    write_json(cache_file, data, indent=False)
+
+def analyze_code_structure(filepath, content):
+    """分析代码结构（按内容哈希缓存，未变更的文件跳过解析）"""
+    cache_key = f"{ANALYSIS_VERSION}:{content_hash(content)}"
     
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.endswith(".py"):
-                python_files.append(Path(root) / file)
+    with _cache_lock:
+        analysis = _analysis_cache.get(cache_key)
+        _used_analysis_keys.add(cache_key)
     
-    return python_files
+    if analysis is None:
+        analysis = _parse_code_structure(content)
+        with _cache_lock:
+            _analysis_cache[cache_key] = analysis
+    
+    return {"file": str(filepath), **analysis}
 
-def analyze_code_structure(filepath, content):
-    """分析代码结构"""
+class _StructureVisitor(ast.NodeVisitor):
+    """收集函数、类和导入信息的AST访问器
+    
+    只遍历模块顶层（含if/try等语句块）和类体，不进入函数体，
+    函数内部的嵌套函数和局部导入不计入结构分析。
+    """
+    
+    def __init__(self, content):
+        # 源码只切分一次，片段按行号截取
+        self.lines = content.splitlines(keepends=True)
+        self.snippet_budget = SNIPPET_BUDGET_CHARS
+        self.functions = []
+        self.classes = []
+        self.imports = []
+    
+    def visit_FunctionDef(self, node):
+        docstring = ast.get_docstring(node)
+        info = {
+            "name": node.name,
+            "args": len(node.args.args),
+            "lineno": node.lineno,
+            "lines": node.end_lineno - node.lineno + 1,
+            "docstring": _doc_summary(docstring)
+        }
+        
+        # 长函数或缺少文档的函数附带源码片段，供AI审查；总长度受文件预算限制
+        if self.snippet_budget > 0 and (info["lines"] > SNIPPET_MIN_LINES or not docstring):
+            source = self._snippet(node, min(SNIPPET_MAX_CHARS, self.snippet_budget))
+            self.snippet_budget -= len(source)
+            info["source"] = source
+        
+        self.functions.append(info)
+    
+    def _snippet(self, node, limit):
+        """按行号截取节点源码，最多limit个字符"""
+        parts = []
+        size = 0
+        for line in self.lines[node.lineno - 1:node.end_lineno]:
+            parts.append(line)
+            size += len(line)
+            if size >= limit:
+                break
+        return "".join(parts)[:limit]
+    
+    visit_AsyncFunctionDef = visit_FunctionDef
+    
+    def visit_ClassDef(self, node):
+        self.classes.append({
+            "name": node.name,
+            "lineno": node.lineno,
+            "docstring": _doc_summary(ast.get_docstring(node))
+        })
+        self.generic_visit(node)
+    
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.imports.append(alias.name)
+    
+    def visit_ImportFrom(self, node):
+        module = node.module or ""
+        for alias in node.names:
+            self.imports.append(f"{module}.{alias.name}")
+
+def _doc_summary(docstring):
+    """文档字符串只保留首行摘要，缺少文档时返回None"""
+    if not docstring:
+        return None
+    return docstring.strip().split("\n", 1)[0]
+
+def _parse_code_structure(content):
+    """解析代码结构，返回不含文件路径的分析结果"""
     try:
         tree = ast.parse(content)
         
-        # 收集信息
-        functions = []
-        classes = []
-        imports = []
-        
-        for node in ast.walk(tree):
-            if isinstance(node, ast.FunctionDef):
-                functions.append({
-                    "name": node.name,
-                    "args": len(node.args.args),
-                    "lineno": node.lineno,
-                    "docstring": ast.get_docstring(node)
-                })
-            elif isinstance(node, ast.ClassDef):
-                classes.append({
-                    "name": node.name,
-                    "lineno": node.lineno,
-                    "docstring": ast.get_docstring(node)
-                })
-            elif isinstance(node, ast.Import):
-                for alias in node.names:
-                    imports.append(alias.name)
-            elif isinstance(node, ast.ImportFrom):
-                module = node.module or ""
-                for alias in node.names:
-                    imports.append(f"{module}.{alias.name}")
+        # 单次遍历收集函数、类和导入信息
+        visitor = _StructureVisitor(content)
+        visitor.visit(tree)
         
         return {
-            "file": str(filepath),
-            "functions": functions,
-            "classes": classes,
-            "imports": imports,
+            "functions": visitor.functions,
+            "classes": visitor.classes,
+            "imports": visitor.imports,
             "line_count": len(content.splitlines()),
             "char_count": len(content)
         }
     except SyntaxError as e:
         return {
-            "file": str(filepath),
             "error": f"语法错误: {e}",
             "line_count": len(content.splitlines())
         }
 
-def perform_ai_code_review(ai_helper, filepath, content, analysis):
-    """执行AI代码审查"""
-    print(f"审查代码: {filepath}")
+def perform_ai_code_review(ai_helper, filepath, content, analysis, cache_key=None):
+    """执行AI代码审查
+    
+    content 为已截断的代码预览；提供 cache_key 时缓存审查结果。请求失败时返回None。
+    """
+    log(f"审查代码: {filepath}")
     
     # 准备审查提示
-    prompt = f"""请对以下Python代码进行专业代码审查：
-
-文件: {filepath}
-
-代码内容:
-```python
-{content[:2000]}  # 限制长度
-```
+    prompt = "".join([
+        _PROMPT_PREFIX,
+        _file_section(filepath, content, analysis),
+        _PROMPT_SUFFIX
+    ])
+    
+    # 调用AI审查
+    review_text = request_review(ai_helper, prompt, REVIEW_MAX_LENGTH, filepath)
+    if review_text is None:
+        return None
+    
+    if cache_key:
+        cache_review(cache_key, review_text)
+    return build_review(filepath, analysis, review_text)
 
-代码分析:
-{json.dumps(analysis, indent=2, ensure_ascii=False)}
+def perform_ai_code_review_batch(ai_helper, items):
+    """批量执行AI代码审查
+    
+    将多个文件合并到一次API请求中，按 ===FILE i=== 分隔符拆分响应。
+    items 为 (filepath, content, analysis, cache_key) 元组列表，审查失败的文件对应位置为None。
+    """
+    if len(items) == 1 or _batching_disabled.is_set():
+        return [perform_ai_code_review(ai_helper, *item) for item in items]
+    
+    log(f"批量审查 {len(items)} 个文件: {', '.join(str(item[0]) for item in items)}")
+    
+    parts = [_BATCH_PROMPT_PREFIX.format(count=len(items))]
+    for i, (filepath, content, analysis, _) in enumerate(items, 1):
+        parts.append(f"===FILE {i}===\n")
+        parts.append(_file_section(filepath, content, analysis))
+        parts.append("\n\n")
+    parts.append(_BATCH_PROMPT_SUFFIX)
+    prompt = "".join(parts)
+    
+    try:
+        review_text = request_review(
+            ai_helper, prompt, REVIEW_MAX_LENGTH, f"{len(items)} 个文件", raise_client_errors=True
+        )
+    except HFAPIError as e:
+        # 批量请求被模型拒绝（如输入过长），本次运行改为逐个文件审查
+        log(f"⚠️  批量审查请求被拒绝，改为逐个文件审查: {e}")
+        _batching_disabled.set()
+        return [perform_ai_code_review(ai_helper, *item) for item in items]
+    
+    if review_text is None:
+        # 暂时性错误已在会话中重试过，不再逐个文件重复请求
+        return [None] * len(items)
+    
+    segments = split_batch_review(review_text, len(items))
+    if not segments:
+        # 模型不支持按分隔符输出，本次运行余下的批次改为逐个文件审查
+        log("⚠️  批量审查响应中没有文件分隔符，改为逐个文件审查")
+        _batching_disabled.set()
+    
+    reviews = []
+    for i, (filepath, content, analysis, cache_key) in enumerate(items, 1):
+        review_text = segments.get(i)
+        if not review_text:
+            # 响应中缺少该文件的分段，单独重新审查
+            reviews.append(perform_ai_code_review(ai_helper, filepath, content, analysis, cache_key))
+            continue
+        
+        if cache_key:
+            cache_review(cache_key, review_text)
+        reviews.append(build_review(filepath, analysis, review_text))
+    
+    return reviews
 
-审查要求:
-1. 代码质量评估
-2. 潜在问题发现
-3. 性能优化建议
-4. 安全性检查
-5. 可读性改进
-6. 规范符合性（PEP 8）
-7. 具体修改建议
+def request_review(ai_helper, prompt, max_length, label, raise_client_errors=False):
+    """请求AI审查，返回审查文本，请求失败或生成内容为空时返回None
+    
+    流式模式下边接收边检查问题标记，生成过程中即可输出发现问题的提示。
+    raise_client_errors 为True时，请求被拒绝（除429外的4xx）的 HFAPIError 直接抛出。
+    """
+    chunks = []
+    issue_reported = False
+    try:
+        if not STREAM_REVIEWS:
+            review = ai_helper.query(prompt, max_length=max_length)
+            chunks.append(extract_generated_text(review))
+        else:
+            tail = ""
+            for chunk in ai_helper.stream(prompt, max_length=max_length):
+                chunks.append(chunk)
+                if issue_reported:
+                    continue
+                # 问题标记可能被拆到相邻的token中，连同上一段末尾一起检查
+                window = tail + chunk
+                tail = window[-STREAM_TAIL_CHARS:]
+                if has_issues(window):
+                    issue_reported = True
+                    log(f"⚠️  审查生成中发现问题: {label}")
+    except HFAPIError as e:
+        if raise_client_errors and is_client_error(e):
+            raise
+        log(f"❌ {e}")
+        return None
+    
+    # 空生成结果不能算作通过审查，也不写入缓存
+    review_text = "".join(chunks)
+    if not review_text.strip():
+        log(f"❌ AI返回的审查内容为空: {label}")
+        return None
+    return review_text
 
-请用中文回复，格式：
-- ✅ 优点
-- ⚠️  问题
-- 🔧 建议
-- 📝 具体修改
+def is_client_error(error):
+    """请求本身被拒绝（4xx，不含已重试过的429），重试相同请求无意义"""
+    status = error.status_code
+    return status is not None and 400 <= status < 500 and status != 429
 
-针对风荷载计算项目的特殊性，请特别关注：
-- 数值计算准确性
-- 错误处理完整性
-- 文档完整性
-- 工程应用可靠性"""
+def _file_section(filepath, content, analysis):
+    """构建单个文件的审查内容段落
     
-    # 调用AI审查
-    review = ai_helper.query(prompt, max_length=1500)
+    默认只发送结构摘要（含长函数/无文档函数的源码片段，总长度受预算限制），
+    摘要不足以反映代码或片段不比预览短时改为附带代码预览。
+    """
+    parts = ["文件: ", str(filepath)]
+    functions = analysis.get("functions", [])
+    snippet_chars = sum(len(info.get("source", "")) for info in functions)
     
-    if isinstance(review, list) and len(review) > 0:
-        review_text = review[0].get("generated_text", "")
-    elif isinstance(review, dict) and "generated_text" in review:
-        review_text = review["generated_text"]
-    else:
-        review_text = str(review)
+    # 源码片段不比代码预览短时，直接发送预览并从摘要中去掉片段
+    if needs_source_preview(analysis) or snippet_chars >= len(content):
+        parts += ["\n\n代码内容:\n```python\n", content, "\n```"]
+        if snippet_chars:
+            stripped = [{k: v for k, v in info.items() if k != "source"} for info in functions]
+            analysis = {**analysis, "functions": stripped}
     
+    parts += [
+        "\n\n代码结构摘要:\n",
+        json.dumps(analysis, ensure_ascii=False, separators=(",", ":"))
+    ]
+    return "".join(parts)
+
+def needs_source_preview(analysis):
+    """语法错误或没有函数/类（顶层脚本）的文件需要发送代码预览"""
+    return "error" in analysis or not (analysis.get("functions") or analysis.get("classes"))
+
+def build_review(filepath, analysis, review_text):
+    """构建单个文件的审查结果，报告文件名在此一次性确定"""
+    path = Path(filepath)
     return {
-        "file": str(filepath),
+        "file": str(path),
+        "report_name": path.name.replace(".py", "_review.md"),
         "analysis": analysis,
         "review": review_text,
-        "has_issues": "⚠️" in review_text or "❌" in review_text or "问题" in review_text
+        "has_issues": has_issues(review_text)
     }
 
+def split_batch_review(review_text, count):
+    """按文件分隔符拆分批量审查响应，返回 {序号: 审查文本}"""
+    segments = {}
+    parts = _FILE_DELIMITER_RE.split(review_text)
+    
+    # parts: [前导文本, 序号1, 内容1, 序号2, 内容2, ...]
+    for index, text in zip(parts[1::2], parts[2::2]):
+        index = int(index)
+        if 1 <= index <= count and text.strip():
+            segments[index] = text.strip()
+    
+    return segments
+
+def load_cached_review(key):
+    """读取缓存的审查文本，未命中或缓存为空时返回None"""
+    try:
+        review_text = (REVIEW_CACHE_DIR / f"{key}.txt").read_text(encoding='utf-8')
+    except OSError:
+        return None
+    return review_text if review_text.strip() else None
+
+def cache_review(key, review_text):
+    """缓存审查文本"""
+    REVIEW_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    (REVIEW_CACHE_DIR / f"{key}.txt").write_text(review_text, encoding='utf-8')
+
+def has_issues(review_text):
+    """判断审查文本是否指出问题"""
+    return "⚠️" in review_text or "❌" in review_text or "问题" in review_text
+
+def count_issue_markers(review_text):
+    """统计审查文本中的问题标记数"""
+    return review_text.count("⚠️") + review_text.count("❌")
+
+def iter_batches(iterable, size):
+    """按固定大小分批"""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def _review_batch(ai_helper, batch_files):
+    """读取、分析并审查一批文件，返回审查结果列表（不含审查失败的文件）"""
+    items = []
+    for filepath in batch_files:
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                content = f.read()
+            
+            # 完整内容只用于结构分析和缓存键，审查提示仅需截断后的预览
+            analysis = analyze_code_structure(filepath, content)
+            key = review_cache_key(ai_helper, content)
+            with _cache_lock:
+                _used_review_keys.add(key)
+            items.append((filepath, content[:REVIEW_PREVIEW_CHARS], analysis, key))
+            del content
+        except Exception as e:
+            log(f"❌ 审查失败 {filepath}: {e}")
+    
+    # 内容未变更的文件直接复用上次的审查结果
+    reviews = []
+    pending = []
+    for filepath, content, analysis, key in items:
+        review_text = load_cached_review(key)
+        if review_text is None:
+            pending.append((filepath, content, analysis, key))
+            reviews.append(None)
+        else:
+            reviews.append(build_review(filepath, analysis, review_text))
+    
+    # AI审查
+    if pending:
+        try:
+            fresh = iter(perform_ai_code_review_batch(ai_helper, pending))
+            reviews = [review or next(fresh) for review in reviews]
+        except Exception as e:
+            log(f"❌ 批量审查失败: {e}")
+    
+    # 审查失败的文件不计入结果，避免被当作通过审查
+    for (filepath, *_), review in zip(items, reviews):
+        if review is None:
+            log(f"❌ 审查失败，未计入结果: {filepath}")
+    reviews = [review for review in reviews if review]
+    
+    for review in reviews:
+        if review["has_issues"]:
+            log(f"⚠️  发现问题: {review['file']}")
+        else:
+            log(f"✅ 通过审查: {review['file']}")
+    
+    return reviews
+
 def generate_review_summary(ai_helper, all_reviews):
-    """生成审查总结"""
+    """生成审查总结，请求失败时总结文本为None"""
     print("生成审查总结...")
     
     summary_data = {
@@ -141,6 +509,18 @@ def generate_review_summary(ai_helper, all_reviews):
         "reviews": all_reviews
     }
     
+    # 只发送问题最多的文件的审查摘录，不附带完整分析数据
+    issue_reviews = sorted(
+        (r for r in all_reviews if r["has_issues"]),
+        key=lambda r: count_issue_markers(r["review"]),
+        reverse=True
+    )[:SUMMARY_MAX_FILES]
+    compact = [{
+        "file": r["file"],
+        "issues_excerpt": r["review"][:SUMMARY_EXCERPT_CHARS],
+        "n_functions": len(r["analysis"].get("functions", []))
+    } for r in issue_reviews]
+    
     # 生成总结提示
     prompt = f"""请基于以下代码审查结果生成项目总结：
 
@@ -150,8 +530,8 @@ def generate_review_summary(ai_helper, all_reviews):
 - 总函数数: {summary_data['total_functions']}
 - 总类数: {summary_data['total_classes']}
 
-详细审查结果:
-{json.dumps([r for r in all_reviews if r['has_issues']], indent=2, ensure_ascii=False)}
+主要问题文件（按问题数排序，最多{SUMMARY_MAX_FILES}个）:
+{json.dumps(compact, ensure_ascii=False, separators=(",", ":"))}
 
 总结要求:
 1. 项目整体代码质量评估
@@ -162,67 +542,109 @@ def generate_review_summary(ai_helper, all_reviews):
 
 请用专业的技术报告格式，适合项目管理者阅读。"""
     
-    summary = ai_helper.query(prompt, max_length=1000)
+    try:
+        summary = ai_helper.query(prompt, max_length=1000)
+        summary_text = extract_generated_text(summary)
+    except HFAPIError as e:
+        log(f"❌ 生成总结失败: {e}")
+        summary_text = None
     
-    if isinstance(summary, list) and len(summary) > 0:
-        summary_text = summary[0].get("generated_text", "")
-    elif isinstance(summary, dict) and "generated_text" in summary:
-        summary_text = summary["generated_text"]
-    else:
-        summary_text = str(summary)
+    if summary_text is not None and not summary_text.strip():
+        log("❌ 生成总结失败: AI返回的内容为空")
+        summary_text = None
     
     return {
         "summary": summary_text,
         "data": summary_data
     }
 
+def _produce_batches(batch_queue, consumer_count):
+    """生产者：遍历目录并按批放入队列，返回找到的文件数
+    
+    src目录下没有Python文件时改为查找当前目录。结束后为每个消费者放入结束标记。
+    """
+    file_count = 0
+    try:
+        for directory in ("src", "."):
+            batches = iter_batches(iter_python_files(directory), REVIEW_BATCH_SIZE)
+            for batch in batches:
+                batch_queue.put((file_count, batch))
+                file_count += len(batch)
+            
+            if file_count or directory == ".":
+                break
+            log("⚠️  未找到src目录，尝试当前目录")
+    finally:
+        for _ in range(consumer_count):
+            batch_queue.put(None)
+    
+    return file_count
+
+def _review_worker(ai_helper, batch_queue):
+    """消费者：从队列取批次审查，直到收到结束标记，返回 (批次序号, 审查结果) 列表"""
+    results = []
+    while (item := batch_queue.get()) is not None:
+        index, batch_files = item
+        try:
+            results.append((index, _review_batch(ai_helper, batch_files)))
+        except Exception as e:
+            log(f"❌ 批量审查失败: {e}")
+    
+    return results
+
+def _write_review_file(review_file, review, review_time):
+    """写入单个文件的审查报告"""
+    with open(review_file, 'w', encoding='utf-8') as f:
+        f.write(f"# 代码审查报告: {review['file']}\n\n")
+        f.write(f"**审查时间**: {review_time}\n")
+        f.write(f"**文件大小**: {review['analysis'].get('line_count', 0)} 行\n\n")
+        f.write("---\n\n")
+        f.write(review["review"])
+
 def save_review_results(all_reviews, summary):
     """保存审查结果"""
     # 保存详细审查结果
     reviews_dir = Path("code_reviews")
     reviews_dir.mkdir(exist_ok=True)
     
-    # 保存每个文件的审查
+    # 保存每个文件的审查（同名文件以后者为准，各文件并发写入）
+    review_files = {}
     for review in all_reviews:
-        filename = Path(review["file"]).name.replace(".py", "_review.md")
-        review_file = reviews_dir / filename
-        
-        with open(review_file, 'w', encoding='utf-8') as f:
-            f.write(f"# 代码审查报告: {review['file']}\n\n")
-            f.write(f"**审查时间**: {os.path.getmtime(__file__)}\n")
-            f.write(f"**文件大小**: {review['analysis'].get('line_count', 0)} 行\n\n")
-            f.write("---\n\n")
-            f.write(review["review"])
-    
-    # 保存总结
-    summary_file = reviews_dir / "SUMMARY.md"
-    with open(summary_file, 'w', encoding='utf-8') as f:
-        f.write("# 代码审查项目总结\n\n")
-        f.write(summary["summary"])
+        review_files[reviews_dir / review["report_name"]] = review
+    
+    review_time = os.path.getmtime(__file__)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(_write_review_file, review_file, review, review_time)
+            for review_file, review in review_files.items()
+        ]
+        for future in futures:
+            future.result()
+    
+    # 保存总结（生成失败时不写入）
+    if summary["summary"] is not None:
+        summary_file = reviews_dir / "SUMMARY.md"
+        with open(summary_file, 'w', encoding='utf-8') as f:
+            f.write("# 代码审查项目总结\n\n")
+            f.write(summary["summary"])
     
     # 保存JSON数据
     data_file = reviews_dir / "review_data.json"
-    with open(data_file, 'w', encoding='utf-8') as f:
-        json.dump({
-            "summary": summary,
-            "reviews": all_reviews
-        }, f, indent=2, ensure_ascii=False)
+    write_json(data_file, {
+        "summary": summary,
+        "reviews": all_reviews
+    })
     
     # 生成GitHub评论格式
     if os.getenv("GITHUB_ACTIONS"):
-        comments = []
-        for review in all_reviews:
-            if review["has_issues"]:
-                # 简化评论内容
-                comment = {
-                    "path": review["file"],
-                    "line": 1,  # 默认第一行
-                    "body": f"## AI代码审查发现的问题\n\n{review['review'][:500]}..."
-                }
-                comments.append(comment)
+        # 简化评论内容，默认评论在第一行
+        comments = [{
+            "path": review["file"],
+            "line": 1,
+            "body": _GH_COMMENT_HEADER + review["review"][:GH_COMMENT_CHARS] + "..."
+        } for review in all_reviews if review["has_issues"]]
         
-        with open("ai_review_comments.json", 'w', encoding='utf-8') as f:
-            json.dump(comments, f, indent=2, ensure_ascii=False)
+        write_json("ai_review_comments.json", comments)
     
     return reviews_dir
 
@@ -247,37 +669,28 @@ def main():
         print(f"❌ AI助手初始化失败: {e}")
         sys.exit(1)
     
-    # 查找Python文件
-    print("\n🔍 查找Python文件...")
-    python_files = find_python_files("src")
+    # 加载缓存
+    _analysis_cache.update(load_json_cache(ANALYSIS_CACHE_FILE))
     
-    if not python_files:
-        print("⚠️  未找到src目录，尝试当前目录")
-        python_files = find_python_files(".")
+    # 边查找边审查：生产者遍历目录并按批入队，
+    # 消费者并发审查（每批 REVIEW_BATCH_SIZE 个文件一次API请求）
+    print("\n🔍 查找并审查Python文件...")
+    batch_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS + 1) as executor:
+        producer = executor.submit(_produce_batches, batch_queue, MAX_WORKERS)
+        consumers = [executor.submit(_review_worker, ai, batch_queue) for _ in range(MAX_WORKERS)]
+        indexed_reviews = [item for consumer in consumers for item in consumer.result()]
+        file_count = producer.result()
     
-    print(f"找到 {len(python_files)} 个Python文件")
+    print(f"找到 {file_count} 个Python文件")
     
-    # 执行代码审查
-    all_reviews = []
-    for filepath in python_files:
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # 分析代码结构
-            analysis = analyze_code_structure(filepath, content)
-            
-            # AI审查
-            review = perform_ai_code_review(ai, filepath, content, analysis)
-            all_reviews.append(review)
-            
-            if review["has_issues"]:
-                print(f"⚠️  发现问题: {filepath}")
-            else:
-                print(f"✅ 通过审查: {filepath}")
-                
-        except Exception as e:
-            print(f"❌ 审查失败 {filepath}: {e}")
+    # 按批次顺序还原审查结果
+    indexed_reviews.sort(key=itemgetter(0))
+    all_reviews = [review for _, reviews in indexed_reviews for review in reviews]
+    
+    # 保存缓存（只保留本次运行用到的条目）
+    save_json_cache(ANALYSIS_CACHE_FILE, {key: _analysis_cache[key] for key in _used_analysis_keys})
+    prune_cache_dir(REVIEW_CACHE_DIR, _used_review_keys)
     
     # 生成总结
     if all_reviews:
@@ -290,7 +703,8 @@ def main():
         print(f"   审查文件数: {len(all_reviews)}")
         print(f"   发现问题文件: {sum(1 for r in all_reviews if r['has_issues'])}")
         print(f"   输出目录: {output_dir}/")
-        print(f"   总结文件: {output_dir}/SUMMARY.md")
+        if summary["summary"] is not None:
+            print(f"   总结文件: {output_dir}/SUMMARY.md")
         
         # 显示关键问题
         issues = [r for r in all_reviews if r["has_issues"]]
@@ -300,6 +714,8 @@ def main():
                 print(f"   - {issue['file']}")
     else:
         print("❌ 未完成任何代码审查")
+    
+    ai.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -7,19 +7,38 @@ AI文档生成脚本
 import os
 import sys
 import json
+import hashlib
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from huggingface_ai_helper import HuggingFaceAI
+from huggingface_ai_helper import HuggingFaceAI, extract_generated_text
+from script_utils import find_python_files, log, prune_cache_dir, write_json
 
-def find_python_files(directory="src"):
-    """查找Python文件"""
-    python_files = []
-    
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.endswith(".py"):
-                python_files.append(Path(root) / file)
-    
-    return python_files
+# 并发生成文档的最大线程数
+MAX_WORKERS = 8
+
+# 并发读取文件的最大线程数
+READ_WORKERS = 16
+
+# 判断文档类型时读取的文件头部字符数
+HEAD_CHARS = 4096
+
+_DOC_TYPE_RE = re.compile(r"\b(class|def)\s")
+
+# 文档末尾记录源文件哈希的注释，如 <!--hash:abc123-->
+_DOC_HASH_RE = re.compile(r"<!--hash:([0-9a-f]+)-->\s*$")
+
+# 本次运行用到的文档缓存键，结束时删除其余缓存文件
+_used_doc_keys = set()
+_used_doc_keys_lock = threading.Lock()
+
+# AI生成文档的缓存目录
+DOC_CACHE_DIR = Path(".cache") / "ai_docs"
+
+# 文档提示版本，修改提示内容时递增以使文档缓存失效
+PROMPT_VERSION = "v1"
 
 def read_file_content(filepath):
     """读取文件内容"""
@@ -27,32 +46,75 @@ def read_file_content(filepath):
         with open(filepath, 'r', encoding='utf-8') as f:
             return f.read()
     except Exception as e:
-        print(f"读取文件失败 {filepath}: {e}")
+        log(f"读取文件失败 {filepath}: {e}")
+        return ""
+
+def read_file_head(filepath, size=HEAD_CHARS):
+    """读取文件头部内容"""
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return f.read(size)
+    except Exception as e:
+        log(f"读取文件失败 {filepath}: {e}")
         return ""
 
 def determine_doc_type(filename, content):
     """确定文档类型"""
     if "__init__.py" in str(filename):
         return "module"
-    elif "class " in content and "def " in content:
+    
+    # 只扫描文件头部，一次正则遍历找出出现的关键字
+    keywords = set(_DOC_TYPE_RE.findall(content, 0, HEAD_CHARS))
+    if "class" in keywords and "def" in keywords:
         return "class"
-    elif "def " in content:
+    elif "def" in keywords:
         return "function"
     else:
         return "module"
 
+def doc_cache_key(ai_helper, content, doc_type):
+    """文档缓存键：提示版本、模型、文档类型和文件内容共同决定"""
+    raw = "\n".join([PROMPT_VERSION, ai_helper.model, doc_type, content])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def read_doc_hash(docs_file):
+    """读取文档末尾记录的内容哈希，不存在时返回None"""
+    try:
+        text = docs_file.read_text(encoding='utf-8')
+    except OSError:
+        return None
+    
+    match = _DOC_HASH_RE.search(text)
+    return match.group(1) if match else None
+
 def generate_documentation(ai_helper, filepath, content, doc_type):
     """生成文档"""
-    print(f"生成 {doc_type} 文档: {filepath}")
+    docs_dir = Path("docs") / filepath.parent.relative_to("src")
+    docs_file = docs_dir / f"{filepath.stem}.md"
+    key = doc_cache_key(ai_helper, content, doc_type)
+    with _used_doc_keys_lock:
+        _used_doc_keys.add(key)
     
-    # 生成文档
-    documentation = ai_helper.generate_documentation(content, doc_type)
+    # 已有文档记录的哈希与当前内容一致时无需重新生成
+    if read_doc_hash(docs_file) == key:
+        log(f"⏭️  文档未变更，跳过: {filepath}")
+        return docs_file
     
-    # 保存到docs目录
-    docs_dir = Path("docs") / filepath.parent.relative_to("src")
-    docs_dir.mkdir(parents=True, exist_ok=True)
+    log(f"生成 {doc_type} 文档: {filepath}")
     
-    docs_file = docs_dir / f"{filepath.stem}.md"
+    # 内容未变更时复用上次生成的文档
+    cache_file = DOC_CACHE_DIR / f"{key}.md"
+    
+    if cache_file.exists():
+        documentation = cache_file.read_text(encoding='utf-8')
+    else:
+        # 请求失败时抛出 HFAPIError，由调用方记录，不写入缓存和文档
+        documentation = ai_helper.generate_documentation(content, doc_type)
+        DOC_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cache_file.write_text(documentation, encoding='utf-8')
+    
+    # 保存到docs目录，末尾记录内容哈希供下次比对
+    docs_dir.mkdir(parents=True, exist_ok=True)
     
     with open(docs_file, 'w', encoding='utf-8') as f:
         f.write(f"# {filepath.name} 文档\n\n")
@@ -60,24 +122,49 @@ def generate_documentation(ai_helper, filepath, content, doc_type):
         f.write(f"**文档类型**: {doc_type}\n\n")
         f.write("---\n\n")
         f.write(documentation)
+        f.write(f"\n\n<!--hash:{key}-->\n")
     
-    print(f"✅ 文档已保存: {docs_file}")
+    log(f"✅ 文档已保存: {docs_file}")
     return docs_file
 
+def _document_one(ai_helper, filepath):
+    """读取单个文件并生成文档，失败时返回None"""
+    content = read_file_content(filepath)
+    if not content:
+        return None
+    
+    doc_type = determine_doc_type(filepath, content)
+    try:
+        return generate_documentation(ai_helper, filepath, content, doc_type)
+    except Exception as e:
+        log(f"❌ 生成文档失败 {filepath}: {e}")
+        return None
+
+def _module_file_info(filepath):
+    """获取模块概览所需的文件信息，空文件或读取失败时返回None"""
+    try:
+        size = filepath.stat().st_size
+    except OSError as e:
+        log(f"读取文件失败 {filepath}: {e}")
+        return None
+    
+    head = read_file_head(filepath) if size else ""
+    if not head:
+        return None
+    
+    return {
+        "file": str(filepath),
+        "type": determine_doc_type(filepath, head),
+        "size": size
+    }
+
 def generate_module_overview(ai_helper, module_files):
     """生成模块概览"""
     print("生成模块概览...")
     
-    module_info = []
-    for filepath in module_files:
-        content = read_file_content(filepath)
-        if content:
-            doc_type = determine_doc_type(filepath, content)
-            module_info.append({
-                "file": str(filepath),
-                "type": doc_type,
-                "size": len(content)
-            })
+    # 大小取自文件元数据，类型只需文件头部判断，无需读取全文
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+        module_info = [info for info in executor.map(_module_file_info, module_files) if info]
     
     # 生成概览文档
     prompt = f"""请为以下Python模块生成中文概览文档：
@@ -96,14 +183,9 @@ def generate_module_overview(ai_helper, module_files):
 
 请用专业的Markdown格式。"""
     
+    # 请求失败或响应格式不符时抛出异常，由调用方记录，不写入概览
     overview = ai_helper.query(prompt, max_length=1000)
-    
-    if isinstance(overview, list) and len(overview) > 0:
-        overview_text = overview[0].get("generated_text", "")
-    elif isinstance(overview, dict) and "generated_text" in overview:
-        overview_text = overview["generated_text"]
-    else:
-        overview_text = str(overview)
+    overview_text = extract_generated_text(overview)
     
     # 保存概览
     overview_file = Path("docs") / "OVERVIEW.md"
@@ -148,17 +230,15 @@ def main():
     
     print(f"找到 {len(python_files)} 个Python文件")
     
-    # 生成文档
+    # 并发生成文档
     generated_files = []
-    for filepath in python_files:
-        content = read_file_content(filepath)
-        if content:
-            doc_type = determine_doc_type(filepath, content)
-            try:
-                docs_file = generate_documentation(ai, filepath, content, doc_type)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for docs_file in executor.map(partial(_document_one, ai), python_files):
+            if docs_file is not None:
                 generated_files.append(docs_file)
-            except Exception as e:
-                print(f"❌ 生成文档失败 {filepath}: {e}")
+    
+    # 只保留本次运行用到的文档缓存
+    prune_cache_dir(DOC_CACHE_DIR, _used_doc_keys)
     
     # 生成项目概览
     if python_files:
@@ -168,9 +248,12 @@ def main():
         except Exception as e:
             print(f"❌ 生成概览失败: {e}")
     
+    ai.close()
+    
     # 生成索引
     print("\n📋 生成文档索引...")
     index_file = Path("docs") / "README.md"
+    index_file.parent.mkdir(parents=True, exist_ok=True)
     with open(index_file, 'w', encoding='utf-8') as f:
         f.write("# 风荷载计算工具 - 文档索引\n\n")
         f.write("> 本文档由AI自动生成\n\n")
@@ -180,10 +263,13 @@ def main():
         f.write("- [项目概览](OVERVIEW.md)\n\n")
         
         f.write("### 模块文档\n")
-        for docs_file in generated_files:
-            if docs_file.name != "OVERVIEW.md" and docs_file.name != "README.md":
-                rel_path = docs_file.relative_to("docs")
-                f.write(f"- [{rel_path}]({rel_path})\n")
+        docs_dir = Path("docs")
+        rel_paths = [
+            docs_file.relative_to(docs_dir)
+            for docs_file in generated_files
+            if docs_file.name not in ("OVERVIEW.md", "README.md")
+        ]
+        f.writelines(f"- [{rel_path}]({rel_path})\n" for rel_path in rel_paths)
     
     print(f"\n✅ 文档生成完成！")
     print(f"   生成文档数: {len(generated_files)}")
@@ -198,8 +284,7 @@ def main():
         "docs_files": [str(f) for f in generated_files]
     }
     
-    with open("docs_generation_report.json", 'w', encoding='utf-8') as f:
-        json.dump(report, f, indent=2, ensure_ascii=False)
+    write_json("docs_generation_report.json", report)
     
     print(f"\n📊 报告已保存: docs_generation_report.json")
 
@@ -4,9 +4,20 @@
 """
 
 import os
-import json
 import sys
+from functools import lru_cache
 from pathlib import Path
+from script_utils import write_json
+
+# 高度系数（按地面粗糙度类别，D类及未知类别取1.6）
+HEIGHT_FACTORS = {"A": 1.0, "B": 1.2, "C": 1.4, "D": 1.6}
+DEFAULT_HEIGHT_FACTOR = 1.6
+
+# 基本风压（简化）: q = 0.5 × ρ × v² / 1000
+BASIC_WIND_PRESSURE = 0.5 * 1.25 * (30 ** 2) / 1000
+
+# 体型系数
+SHAPE_FACTOR = 1.3
 
 def create_example_calculations():
     """创建计算示例"""
@@ -47,36 +58,18 @@ def create_example_calculations():
 
 def simulate_calculation_results(building_params):
     """模拟计算结果"""
-    height = building_params["height"]
-    terrain = building_params["terrain_category"]
-    
-    # 简化计算逻辑
-    if terrain == "A":
-        height_factor = 1.0
-    elif terrain == "B":
-        height_factor = 1.2
-    elif terrain == "C":
-        height_factor = 1.4
-    else:  # D
-        height_factor = 1.6
-    
-    # 基本风压（简化）
-    basic_wind_pressure = 0.5 * 1.25 * (30 ** 2) / 1000
-    
-    # 体型系数
-    shape_factor = 1.3
-    
-    # 计算风压
-    wind_pressure = basic_wind_pressure * height_factor * shape_factor
-    
-    # 总风荷载
-    area = building_params["width"] * building_params["height"]
-    total_wind_load = wind_pressure * area
-    
+    return _format_results(*_compute_wind_load(
+        building_params["height"],
+        building_params["width"],
+        building_params["terrain_category"]
+    ))
+
+def _format_results(basic_wind_pressure, height_factor, wind_pressure, area, total_wind_load):
+    """将计算值整理为结果字典"""
     return {
         "basic_wind_pressure": round(basic_wind_pressure, 3),
         "height_factor": round(height_factor, 2),
-        "shape_factor": shape_factor,
+        "shape_factor": SHAPE_FACTOR,
         "wind_pressure": round(wind_pressure, 3),
         "building_area": round(area, 1),
         "total_wind_load": round(total_wind_load, 1),
@@ -87,6 +80,20 @@ def simulate_calculation_results(building_params):
         }
     }
 
+@lru_cache(maxsize=256)
+def _compute_wind_load(height, width, terrain):
+    """计算风荷载（简化计算逻辑，相同参数只计算一次）"""
+    height_factor = HEIGHT_FACTORS.get(terrain, DEFAULT_HEIGHT_FACTOR)
+    
+    # 计算风压
+    wind_pressure = BASIC_WIND_PRESSURE * height_factor * SHAPE_FACTOR
+    
+    # 总风荷载
+    area = width * height
+    total_wind_load = wind_pressure * area
+    
+    return BASIC_WIND_PRESSURE, height_factor, wind_pressure, area, total_wind_load
+
 def generate_text_report(building_params, results):
     """生成文本报告（不依赖AI）"""
     report = f"""# {building_params['name']} - 风荷载计算报告
@@ -148,12 +155,11 @@ def save_report(building_name, report_content, results_data, building_params):
         f.write(report_content)
     
     data_file = reports_dir / f"{safe_name}_data.json"
-    with open(data_file, 'w', encoding='utf-8') as f:
-        json.dump({
-            "building_params": building_params,
-            "results": results_data,
-            "generated_at": os.path.getmtime(__file__)
-        }, f, indent=2, ensure_ascii=False)
+    write_json(data_file, {
+        "building_params": building_params,
+        "results": results_data,
+        "generated_at": os.path.getmtime(__file__)
+    })
     
     print(f"✅ 报告已保存: {report_file}")
     return report_file
@@ -2,24 +2,270 @@
 """
 Hugging Face Inference API 辅助工具
 用于风荷载计算项目的AI辅助功能
+
+同一进程内建议通过 HuggingFaceAI.default() 共享实例，复用会话的连接池：
+
+    ai = HuggingFaceAI.default()
+    text = ai.explain_concept("基本风压")
+
+在异步Web服务（如Starlette）中使用时，通过 mount(app) 把推理请求汇入单个后台工作任务，
+处理函数只需入队并等待结果，不会阻塞事件循环：
+
+    ai = HuggingFaceAI(enable_batching=True)
+    ai.mount(app)
+
+    async def handler(request):
+        resp_q = asyncio.Queue()
+        await request.app.state.hf_q.put((prompt, resp_q))
+        result = await resp_q.get()
 """
 
 import os
+import asyncio
+import hashlib
 import requests
 import json
+import logging
+import threading
 import time
-from typing import Dict, Any, Optional
+from pathlib import Path
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional, Tuple, Union
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，未安装时使用标准库json
+    orjson = None
+
+try:
+    import httpx
+except ImportError:  # 可选依赖，未安装时异步请求在线程中复用requests会话
+    httpx = None
+
+try:
+    import h2  # noqa: F401  httpx的HTTP/2支持（httpx[http2]）
+except ImportError:  # 未安装时同样回退到线程中的requests会话
+    h2 = None
+
+try:
+    from transformers import AutoTokenizer
+except ImportError:  # 可选依赖，未安装时按字符数估算token数
+    AutoTokenizer = None
+
+# 连接池：缓存的主机连接池数及每个池保持的最大连接数
+POOL_CONNECTIONS = 32
+POOL_MAXSIZE = 128
+
+# 请求超时（连接, 读取），单位秒；冷启动模型生成可能较慢
+REQUEST_TIMEOUT = (5, 360)
+
+# 限流(429)及网关错误时的重试次数与退避基数（秒）
+MAX_RETRIES = 5
+RETRY_BACKOFF = 0.5
+RETRY_STATUS = (429, 502, 503, 504)
+
+# 生成长度：max_length作为生成token数上限，实际max_new_tokens按提示长度收紧，但不少于MIN_NEW_TOKENS
+DEFAULT_MAX_LENGTH = 500
+MIN_NEW_TOKENS = 128
+
+# 默认生成参数与请求选项
+DEFAULT_PARAMETERS = {
+    "temperature": 0.7,
+    "top_p": 0.9,
+    "do_sample": True,
+    "return_full_text": False
+}
+DEFAULT_OPTIONS = {
+    "wait_for_model": True,
+    "use_cache": True
+}
+
+# query_many 按提示长度（字符数）分桶，同桶请求作为一波并发发出以减少服务端填充
+LENGTH_BUCKETS = (128, 512, 2048, 8192)
+# 每个桶的生成长度上限 = min(桶上限 × 2, BUCKET_MAX_LENGTH)
+BUCKET_MAX_LENGTH = 1024
+
+# 请求合并：同一批次最多的提示数与等待凑批的最长时间（秒）
+MAX_BATCH_SIZE = 16
+MAX_BATCH_DELAY = 0.02
+
+# 本地响应缓存的默认磁盘目录
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "hf_ai_helper"
+
+logger = logging.getLogger(__name__)
+
+# 进程内共享实例，按 (模型, Token指纹) 区分
+_default_lock = threading.Lock()
+_default_instances: Dict[tuple, "HuggingFaceAI"] = {}
+
+
+class HFAPIError(RuntimeError):
+    """Hugging Face API请求失败（重试用尽后仍失败或响应格式不符）"""
+    
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _dumps_payload(data: Any) -> bytes:
+    """序列化请求体，安装了orjson时使用orjson加速"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _loads(data: Union[bytes, str]) -> Any:
+    """解析JSON，安装了orjson时使用orjson加速"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _parse_response(content: bytes) -> Any:
+    """解析API响应体；直接解析字节，跳过requests的编码探测，无效JSON时抛出 HFAPIError"""
+    try:
+        return _loads(content)
+    except ValueError as e:
+        raise HFAPIError(f"API响应不是有效的JSON: {e}") from e
+
+
+def extract_generated_text(result: Union[List[Dict[str, Any]], Dict[str, Any]]) -> str:
+    """从API响应中提取生成文本，响应格式不符时抛出 HFAPIError"""
+    if isinstance(result, list) and result:
+        result = result[0]
+    if isinstance(result, dict) and isinstance(result.get("generated_text"), str):
+        return result["generated_text"]
+    raise HFAPIError(f"无法识别的API响应: {str(result)[:200]}")
+
+
+def _dumps_pretty(data: Any) -> str:
+    """序列化为缩进的JSON文本，用于注入提示"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(data, indent=2, ensure_ascii=False)
+
+
+def _raise_for_status(response: requests.Response):
+    """HTTP错误状态时抛出 HFAPIError（可重试的状态已由会话重试策略处理过）"""
+    try:
+        response.raise_for_status()
+    except requests.exceptions.HTTPError as e:
+        raise HFAPIError(f"API请求失败: {e}", response.status_code) from e
+
+
+def _retry_delay(retry_after: Optional[str], attempt: int) -> float:
+    """重试等待时间：优先使用Retry-After（秒），否则按RETRY_BACKOFF指数退避"""
+    try:
+        return max(0.0, float(retry_after))
+    except (TypeError, ValueError):
+        return RETRY_BACKOFF * (2 ** attempt)
+
+
+# 提示模板
+DOC_PROMPT = """请为以下{doc_type}代码生成中文文档说明：
+
+代码：
+```python
+{code_content}
+```
+
+要求：
+1. 简要说明功能
+2. 列出参数说明
+3. 说明返回值
+4. 提供使用示例
+5. 注意事项
+
+请用Markdown格式回复。"""
+
+CONCEPT_PROMPT = """请用中文解释{context}领域的'{concept}'概念：
+
+要求：
+1. 基本定义
+2. 计算公式（如果有）
+3. 工程应用
+4. 相关规范
+5. 实际示例
+
+请用清晰易懂的语言，适合工程师理解。"""
+
+REPORT_PROMPT = """请生成一份专业的风荷载计算报告。
+
+建筑参数：
+{building_params}
+
+计算结果：
+{results}
+
+使用规范：{code_standard}
+
+报告要求：
+1. 项目概述
+2. 计算依据
+3. 参数说明
+4. 计算过程
+5. 结果分析
+6. 结论建议
+7. 注意事项
+
+请用专业的技术报告格式，包含必要的表格和数据。"""
+
+CONTEXT_QUESTION_PROMPT = """基于以下上下文回答技术问题：
+
+上下文：
+{context}
+
+问题：
+{question}
+
+要求：
+1. 准确回答核心问题
+2. 提供相关公式或规范引用
+3. 给出实际应用建议
+4. 如有不确定请说明"""
+
+QUESTION_PROMPT = """请回答以下风荷载计算相关技术问题：
+
+问题：
+{question}
+
+要求：
+1. 专业准确的回答
+2. 引用相关规范
+3. 提供计算思路
+4. 工程应用建议"""
+
+# 辅助方法的模板表：名称 -> (提示模板, 生成长度上限)
+_TEMPLATES: Dict[str, Tuple[str, int]] = {
+    "doc": (DOC_PROMPT, 800),
+    "concept": (CONCEPT_PROMPT, 600),
+    "report": (REPORT_PROMPT, 1000),
+    "qa": (QUESTION_PROMPT, 800),
+    "qa_context": (CONTEXT_QUESTION_PROMPT, 800)
+}
 
 class HuggingFaceAI:
     """Hugging Face AI API 封装类"""
     
-    def __init__(self, api_token: str = None, model: str = None):
+    def __init__(self, api_token: str = None, model: str = None,
+                 enable_cache: bool = True, cache_dir: Optional[str] = None,
+                 enable_batching: bool = False, hedge_delay: float = 0.0,
+                 preload: bool = False, use_tokenizer: bool = False,
+                 http2: bool = False):
         """
         初始化Hugging Face AI
         
         参数:
             api_token: Hugging Face API Token
             model: 模型ID，默认 google/flan-t5-large
+            enable_cache: 是否启用本地响应缓存（内存+磁盘）
+            cache_dir: 磁盘缓存目录，默认 ~/.cache/hf_ai_helper
+            enable_batching: 是否将并发的aquery请求合并为一次批量API调用（需模型支持列表输入）
+            hedge_delay: aquery超过该秒数未返回时发出一个相同的对冲请求，取先返回者；0表示不对冲
+            preload: 是否在构造时于后台预热模型
+            use_tokenizer: 是否加载本地分词器精确统计提示token数（需安装transformers）
+            http2: 异步请求是否通过httpx的HTTP/2连接多路复用（需安装httpx[http2]）
         """
         self.api_token = api_token or os.getenv("HF_TOKEN")
         self.model = model or os.getenv("HF_MODEL", "google/flan-t5-large")
@@ -27,6 +273,176 @@ class HuggingFaceAI:
         
         if not self.api_token:
             raise ValueError("需要Hugging Face API Token。设置HF_TOKEN环境变量。")
+        
+        # 复用同一会话，保持连接以避免每次请求重新进行TCP/TLS握手
+        self.session = requests.Session()
+        # 请求头只构建一次，Token预先编码为字节，会话与httpx客户端共用
+        self._auth_header_bytes = f"Bearer {self.api_token}".encode("utf-8")
+        self._headers = {
+            "Authorization": self._auth_header_bytes,
+            "Content-Type": "application/json"
+        }
+        self._stream_headers = {"Accept": "text/event-stream"}
+        self.session.headers.update(self._headers)
+        # 读取超时不重试：生成卡住时每次重试都要再等满读取超时
+        retry = Retry(
+            total=MAX_RETRIES,
+            read=0,
+            backoff_factor=RETRY_BACKOFF,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods=frozenset(["POST"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        
+        # 本地响应缓存：命中时无需网络请求
+        self.enable_cache = enable_cache
+        self.cache_dir = Path(cache_dir) if cache_dir else DEFAULT_CACHE_DIR
+        self._mem_cache: Dict[str, Any] = {}
+        self._cache_lock = threading.Lock()
+        
+        # 基础请求参数只构建一次，每次请求在其副本上覆盖
+        self._base_params = {
+            "parameters": dict(DEFAULT_PARAMETERS),
+            "options": dict(DEFAULT_OPTIONS)
+        }
+        
+        # 请求合并器按事件循环惰性创建
+        self.enable_batching = enable_batching
+        self._batcher: Optional["HFBatcher"] = None
+        
+        # 对冲请求：冷启动等长尾延迟时重复发送，降低尾延迟
+        self.hedge_delay = hedge_delay
+        
+        # 本地分词器按需加载，用于按提示token数确定max_new_tokens
+        self.use_tokenizer = use_tokenizer
+        self._tokenizer = None
+        self._tokenizer_loaded = False
+        self._tokenizer_lock = threading.Lock()
+        
+        # HTTP/2异步客户端按事件循环惰性创建
+        self.http2 = http2 and httpx is not None and h2 is not None
+        if http2 and not self.http2:
+            logger.warning("未安装httpx[http2]，异步请求改用线程中的requests会话")
+        self._aclient = None
+        self._aclient_loop = None
+        
+        if preload:
+            self.warmup()
+    
+    @classmethod
+    def default(cls, model: str = None, api_token: str = None) -> "HuggingFaceAI":
+        """
+        获取进程内共享的实例（线程安全，首次调用时创建）
+        
+        参数:
+            model: 模型ID，默认取HF_MODEL环境变量
+            api_token: Hugging Face API Token，默认取HF_TOKEN环境变量
+            
+        返回:
+            同一模型和Token对应的共享实例
+        """
+        model = model or os.getenv("HF_MODEL", "google/flan-t5-large")
+        api_token = api_token or os.getenv("HF_TOKEN", "")
+        key = (model, hashlib.sha1(api_token.encode("utf-8")).hexdigest())
+        
+        with _default_lock:
+            instance = _default_instances.get(key)
+            if instance is None:
+                instance = _default_instances[key] = cls(api_token=api_token, model=model)
+        return instance
+    
+    def __enter__(self):
+        """进入上下文时在后台预热模型"""
+        self.warmup()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        """退出上下文时关闭HTTP会话"""
+        self.close()
+    
+    def warmup(self, async_: bool = True):
+        """
+        发送一个极小的探测请求，促使远端提前加载模型，避免首次调用承担冷启动延迟
+        
+        参数:
+            async_: 是否在后台线程中执行
+        """
+        if async_:
+            threading.Thread(target=self._warmup, daemon=True).start()
+        else:
+            self._warmup()
+    
+    def _warmup(self):
+        """执行预热探测；绕过本地与服务端缓存，冷启动期间的503等错误忽略"""
+        params = self._build_params("ping", max_new_tokens=1, wait_for_model=True, use_cache=False)
+        try:
+            self._post(params)
+        except HFAPIError as e:
+            logger.warning("模型预热失败: %s", e)
+    
+    def close(self):
+        """关闭HTTP会话"""
+        self.session.close()
+    
+    async def aclose(self):
+        """异步关闭HTTP会话"""
+        if self._batcher is not None:
+            self._batcher.stop()
+            self._batcher = None
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+        await asyncio.to_thread(self.close)
+    
+    def _build_params(self, prompt: str, **kwargs: Any) -> Dict[str, Any]:
+        """构建请求参数"""
+        base = self._base_params
+        parameters = dict(base["parameters"])
+        for name in DEFAULT_PARAMETERS:
+            if name in kwargs:
+                parameters[name] = kwargs[name]
+        
+        # 只限制新生成的token数，短提示不请求过长的生成结果
+        if "max_new_tokens" in kwargs:
+            parameters["max_new_tokens"] = kwargs["max_new_tokens"]
+        else:
+            cap = kwargs.get("max_length", DEFAULT_MAX_LENGTH)
+            parameters["max_new_tokens"] = max(MIN_NEW_TOKENS, min(cap, self._count_tokens(prompt)))
+        
+        # 合并额外参数
+        if "parameters" in kwargs:
+            parameters.update(kwargs["parameters"])
+        
+        # 选项未被覆盖时直接复用基础字典（只读）
+        options = base["options"]
+        if any(name in kwargs for name in DEFAULT_OPTIONS):
+            options = {name: kwargs.get(name, value) for name, value in options.items()}
+        
+        return {"inputs": prompt, "parameters": parameters, "options": options}
+    
+    def _count_tokens(self, prompt: str) -> int:
+        """统计提示的token数；未启用或无法加载分词器时按字符数的一半估算"""
+        tokenizer = self._get_tokenizer()
+        if tokenizer is None:
+            return len(prompt) // 2
+        return len(tokenizer.encode(prompt, add_special_tokens=False))
+    
+    def _get_tokenizer(self):
+        """首次使用时加载模型对应的分词器，加载失败时返回None"""
+        if not self.use_tokenizer or AutoTokenizer is None:
+            return None
+        
+        with self._tokenizer_lock:
+            if not self._tokenizer_loaded:
+                self._tokenizer_loaded = True
+                try:
+                    self._tokenizer = AutoTokenizer.from_pretrained(self.model, use_fast=True)
+                except Exception as e:
+                    logger.warning("加载分词器失败: %s", e)
+        return self._tokenizer
     
     def query(self, prompt: str, **kwargs) -> Dict[str, Any]:
         """
@@ -34,43 +450,329 @@ class HuggingFaceAI:
         
         参数:
             prompt: 提示文本
-            **kwargs: 额外参数
+            **kwargs: 额外参数；max_length为生成token数上限（默认500），
+                      实际发送的max_new_tokens按提示长度收紧；也可直接指定max_new_tokens
+            
+        返回:
+            API响应结果；请求失败时抛出 HFAPIError
+        """
+        params = self._build_params(prompt, **kwargs)
+        
+        key = self._query_cache_key(params, kwargs)
+        if key is not None:
+            cached = self._cache_get(key)
+            if cached is not None:
+                return cached
+        
+        result = self._post(params)
+        if key is not None:
+            self._cache_set(key, result)
+        return result
+    
+    def _post(self, params: Dict[str, Any]) -> Any:
+        """发送一次API请求并返回解析后的JSON，失败时抛出 HFAPIError"""
+        # 限流和网关错误由会话的重试策略按Retry-After/指数退避处理
+        # 会话已设置Content-Type，直接发送预先序列化的请求体
+        try:
+            response = self.session.post(self.api_url, data=_dumps_payload(params), timeout=REQUEST_TIMEOUT)
+            _raise_for_status(response)
+            return _parse_response(response.content)
+        except requests.exceptions.RequestException as e:
+            raise HFAPIError(f"API请求失败: {e}") from e
+    
+    def _query_cache_key(self, params: Dict[str, Any], kwargs: Dict[str, Any]) -> Optional[str]:
+        """返回可缓存请求的缓存键，不可缓存时返回None"""
+        if not self.enable_cache:
+            return None
+        
+        # 采样生成（do_sample且temperature>0）结果不确定，默认不缓存，可用force_cache=True强制缓存
+        parameters = params["parameters"]
+        sampling = parameters.get("do_sample") and parameters.get("temperature", 0) > 0
+        if sampling and not kwargs.get("force_cache"):
+            return None
+        return self._cache_key(params["inputs"], parameters)
+    
+    def _cache_key(self, prompt: str, parameters: Dict[str, Any]) -> str:
+        """缓存键：模型、提示和生成参数共同决定"""
+        raw = json.dumps({"m": self.model, "p": prompt, "par": parameters}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def _cache_get(self, key: str) -> Optional[Any]:
+        """依次查找内存缓存和磁盘缓存，未命中时返回None"""
+        with self._cache_lock:
+            if key in self._mem_cache:
+                return self._mem_cache[key]
+        
+        try:
+            result = _loads((self.cache_dir / f"{key}.json").read_bytes())
+        except (OSError, ValueError):
+            return None
+        
+        with self._cache_lock:
+            self._mem_cache[key] = result
+        return result
+    
+    def _cache_set(self, key: str, result: Any):
+        """写入内存缓存和磁盘缓存"""
+        with self._cache_lock:
+            self._mem_cache[key] = result
+        
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.cache_dir / f"{key}.json", 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False)
+        except OSError as e:
+            logger.warning("写入缓存失败: %s", e)
+    
+    def clear_cache(self):
+        """清空内存缓存和磁盘缓存"""
+        with self._cache_lock:
+            self._mem_cache.clear()
+        
+        for cache_file in self.cache_dir.glob("*.json"):
+            cache_file.unlink(missing_ok=True)
+    
+    async def aquery(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        """
+        异步查询Hugging Face API
+        
+        在线程中执行阻塞的HTTP请求（等待网络时释放GIL），复用同一个连接池会话，
+        不阻塞事件循环，多个请求可并发进行。
+        
+        参数:
+            prompt: 提示文本
+            **kwargs: 额外参数，同query
             
         返回:
             API响应结果
         """
-        headers = {
-            "Authorization": f"Bearer {self.api_token}",
-            "Content-Type": "application/json"
-        }
+        if not (self.enable_batching or self.http2):
+            if self.hedge_delay > 0:
+                return await self._hedged(lambda: asyncio.to_thread(self.query, prompt, **kwargs))
+            return await asyncio.to_thread(self.query, prompt, **kwargs)
         
-        # 默认参数
-        params = {
-            "inputs": prompt,
-            "parameters": {
-                "max_length": kwargs.get("max_length", 500),
-                "temperature": kwargs.get("temperature", 0.7),
-                "top_p": kwargs.get("top_p", 0.9),
-                "do_sample": kwargs.get("do_sample", True),
-                "return_full_text": kwargs.get("return_full_text", False)
-            },
-            "options": {
-                "wait_for_model": kwargs.get("wait_for_model", True),
-                "use_cache": kwargs.get("use_cache", True)
-            }
-        }
+        params = self._build_params(prompt, **kwargs)
+        key = self._query_cache_key(params, kwargs)
+        if key is not None:
+            cached = await asyncio.to_thread(self._cache_get, key)
+            if cached is not None:
+                return cached
         
-        # 合并额外参数
-        if "parameters" in kwargs:
-            params["parameters"].update(kwargs["parameters"])
+        if self.enable_batching:
+            result = await self._get_batcher().submit(params)
+        elif self.hedge_delay > 0:
+            result = await self._hedged(lambda: self._apost(params))
+        else:
+            result = await self._apost(params)
+        
+        if key is not None:
+            await asyncio.to_thread(self._cache_set, key, result)
+        return result
+    
+    async def _hedged(self, make_request) -> Any:
+        """先发出一个请求，超过hedge_delay未返回时再发出相同请求，返回先完成的结果"""
+        first = asyncio.ensure_future(make_request())
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_delay)
+        if done:
+            return first.result()
+        
+        second = asyncio.ensure_future(make_request())
+        done, pending = await asyncio.wait({first, second}, return_when=asyncio.FIRST_COMPLETED)
+        # 线程中的请求无法中断，取消后其结果被丢弃；httpx请求会被真正取消
+        for task in pending:
+            task.cancel()
+        return done.pop().result()
+    
+    async def _apost(self, params: Dict[str, Any]) -> Any:
+        """异步发送一次API请求；启用HTTP/2时使用httpx，否则在线程中复用requests会话"""
+        if not self.http2:
+            return await asyncio.to_thread(self._post, params)
+        
+        client = self._get_aclient()
+        body = _dumps_payload(params)
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                response = await client.post(self.api_url, content=body)
+            except httpx.HTTPError as e:
+                raise HFAPIError(f"API请求失败: {e}") from e
+            
+            if response.status_code not in RETRY_STATUS or attempt == MAX_RETRIES:
+                break
+            # 与会话重试策略一致：优先遵循Retry-After，否则指数退避
+            await asyncio.sleep(_retry_delay(response.headers.get("Retry-After"), attempt))
+        
+        if response.is_error:
+            raise HFAPIError(f"API请求失败: HTTP {response.status_code}", response.status_code)
+        return _parse_response(response.content)
+    
+    def _get_aclient(self):
+        """获取绑定到当前事件循环的httpx异步客户端"""
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            # 旧客户端所属的事件循环已结束，无法再异步关闭，直接替换
+            transport = httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=MAX_RETRIES,
+                limits=httpx.Limits(max_connections=POOL_MAXSIZE, max_keepalive_connections=POOL_CONNECTIONS)
+            )
+            self._aclient = httpx.AsyncClient(
+                transport=transport,
+                headers=self._headers,
+                timeout=httpx.Timeout(REQUEST_TIMEOUT[1], connect=REQUEST_TIMEOUT[0])
+            )
+            self._aclient_loop = loop
+        return self._aclient
+    
+    def mount(self, app, max_batch: int = MAX_BATCH_SIZE):
+        """
+        挂载到Starlette风格的应用：启动时创建请求队列 app.state.hf_q 和后台工作任务
+        
+        处理函数把 (prompt, resp_q) 放入 app.state.hf_q，再从 resp_q 取得结果；
+        结果形式与aquery一致，请求抛出的异常作为结果返回。
+        
+        参数:
+            app: 提供 state 和 add_event_handler 的应用对象
+            max_batch: 工作任务每次从队列取出的最多请求数
+        """
+        async def startup():
+            app.state.hf_q = asyncio.Queue()
+            app.state.hf_worker = asyncio.create_task(self._worker(app.state.hf_q, max_batch))
+        
+        async def shutdown():
+            app.state.hf_worker.cancel()
+            await self.aclose()
+        
+        app.add_event_handler("startup", startup)
+        app.add_event_handler("shutdown", shutdown)
+    
+    async def _worker(self, queue: asyncio.Queue, max_batch: int):
+        """后台工作任务：成批取出队列中的请求并发处理，结果放回各自的响应队列"""
+        running = set()
+        while True:
+            items = [await queue.get()]
+            while len(items) < max_batch and not queue.empty():
+                items.append(queue.get_nowait())
+            # 不等待本批完成即继续取下一批，慢请求不会阻塞后续请求；保留任务引用以免被回收
+            task = asyncio.create_task(self._serve(items))
+            running.add(task)
+            task.add_done_callback(running.discard)
+    
+    async def _serve(self, items: List[tuple]):
+        """处理一批排队的请求"""
+        results = await asyncio.gather(*(self.aquery(prompt) for prompt, _ in items), return_exceptions=True)
+        for (_, resp_q), result in zip(items, results):
+            await resp_q.put(result)
+    
+    def _get_batcher(self) -> "HFBatcher":
+        """获取绑定到当前事件循环的请求合并器"""
+        loop = asyncio.get_running_loop()
+        if self._batcher is None or self._batcher.loop is not loop:
+            self._batcher = HFBatcher(self)
+        return self._batcher
+    
+    def stream(self, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        流式查询Hugging Face API，逐段产出生成的文本
+        
+        需要模型支持流式输出（如TGI部署的文本生成模型）；
+        不支持时返回完整结果。请求失败时抛出 HFAPIError。
+        
+        参数:
+            prompt: 提示文本
+            **kwargs: 额外参数，同query
+            
+        返回:
+            生成文本片段的迭代器
+        """
+        params = self._build_params(prompt, **kwargs)
+        params["stream"] = True
         
         try:
-            response = requests.post(self.api_url, headers=headers, json=params)
-            response.raise_for_status()
-            return response.json()
+            response = self.session.post(
+                self.api_url,
+                data=_dumps_payload(params),
+                headers=self._stream_headers,
+                stream=True,
+                timeout=REQUEST_TIMEOUT
+            )
         except requests.exceptions.RequestException as e:
-            print(f"API请求失败: {e}")
-            return {"error": str(e)}
+            raise HFAPIError(f"API请求失败: {e}") from e
+        
+        with response:
+            _raise_for_status(response)
+            
+            if "text/event-stream" not in response.headers.get("Content-Type", ""):
+                # 模型不支持流式输出，直接返回完整生成结果
+                yield extract_generated_text(_parse_response(response.content))
+                return
+            
+            # 解析SSE事件：data: {"token": {"text": ..., "special": ...}, ...}
+            # 生成中途失败时服务端发送 data: {"error": ..., "error_type": ...}
+            response.encoding = "utf-8"
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or line.startswith(":") or not line.startswith("data:"):
+                        continue
+                    
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    
+                    event = _parse_response(data)
+                    if "error" in event:
+                        raise HFAPIError(f"流式生成失败: {event['error']}")
+                    
+                    token = event.get("token") or {}
+                    if not token.get("special"):
+                        yield token.get("text", "")
+            except requests.exceptions.RequestException as e:
+                raise HFAPIError(f"读取流式响应失败: {e}") from e
+    
+    async def astream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """
+        stream 的异步版本：在线程中读取SSE流，逐段产出生成的文本
+        
+        参数:
+            prompt: 提示文本
+            **kwargs: 额外参数，同query
+            
+        返回:
+            生成文本片段的异步迭代器
+        """
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+        done = object()
+        
+        def pump():
+            try:
+                for text in self.stream(prompt, **kwargs):
+                    loop.call_soon_threadsafe(chunks.put_nowait, text)
+            except Exception as e:
+                loop.call_soon_threadsafe(chunks.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(chunks.put_nowait, done)
+        
+        reader = asyncio.ensure_future(asyncio.to_thread(pump))
+        try:
+            while True:
+                item = await chunks.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            await reader
+    
+    def _run(self, key: str, **fields: str) -> str:
+        """按模板表构建提示并查询，返回生成文本"""
+        template, max_length = _TEMPLATES[key]
+        return extract_generated_text(self.query(template.format(**fields), max_length=max_length))
+    
+    async def _arun(self, key: str, **fields: str) -> str:
+        """_run 的异步版本"""
+        template, max_length = _TEMPLATES[key]
+        return extract_generated_text(await self.aquery(template.format(**fields), max_length=max_length))
     
     def generate_documentation(self, code_content: str, doc_type: str = "function") -> str:
         """
@@ -83,30 +785,7 @@ class HuggingFaceAI:
         返回:
             生成的文档
         """
-        prompt = f"""请为以下{doc_type}代码生成中文文档说明：
-
-代码：
-```python
-{code_content}
-```
-
-要求：
-1. 简要说明功能
-2. 列出参数说明
-3. 说明返回值
-4. 提供使用示例
-5. 注意事项
-
-请用Markdown格式回复。"""
-        
-        result = self.query(prompt, max_length=800)
-        
-        if isinstance(result, list) and len(result) > 0:
-            return result[0].get("generated_text", "生成文档失败")
-        elif isinstance(result, dict) and "generated_text" in result:
-            return result["generated_text"]
-        else:
-            return str(result)
+        return self._run("doc", doc_type=doc_type, code_content=code_content)
     
     def explain_concept(self, concept: str, context: str = "风荷载计算") -> str:
         """
@@ -119,25 +798,7 @@ class HuggingFaceAI:
         返回:
             概念解释
         """
-        prompt = f"""请用中文解释{context}领域的'{concept}'概念：
-
-要求：
-1. 基本定义
-2. 计算公式（如果有）
-3. 工程应用
-4. 相关规范
-5. 实际示例
-
-请用清晰易懂的语言，适合工程师理解。"""
-        
-        result = self.query(prompt, max_length=600)
-        
-        if isinstance(result, list) and len(result) > 0:
-            return result[0].get("generated_text", "解释生成失败")
-        elif isinstance(result, dict) and "generated_text" in result:
-            return result["generated_text"]
-        else:
-            return str(result)
+        return self._run("concept", concept=concept, context=context)
     
     def generate_calculation_report(self, 
                                   building_params: Dict[str, Any],
@@ -154,35 +815,12 @@ class HuggingFaceAI:
         返回:
             计算报告
         """
-        prompt = f"""请生成一份专业的风荷载计算报告。
-
-建筑参数：
-{json.dumps(building_params, indent=2, ensure_ascii=False)}
-
-计算结果：
-{json.dumps(results, indent=2, ensure_ascii=False)}
-
-使用规范：{code_standard}
-
-报告要求：
-1. 项目概述
-2. 计算依据
-3. 参数说明
-4. 计算过程
-5. 结果分析
-6. 结论建议
-7. 注意事项
-
-请用专业的技术报告格式，包含必要的表格和数据。"""
-        
-        result = self.query(prompt, max_length=1000)
-        
-        if isinstance(result, list) and len(result) > 0:
-            return result[0].get("generated_text", "报告生成失败")
-        elif isinstance(result, dict) and "generated_text" in result:
-            return result["generated_text"]
-        else:
-            return str(result)
+        return self._run(
+            "report",
+            building_params=_dumps_pretty(building_params),
+            results=_dumps_pretty(results),
+            code_standard=code_standard
+        )
     
     def answer_technical_question(self, question: str, context: str = "") -> str:
         """
@@ -195,43 +833,200 @@ class HuggingFaceAI:
         返回:
             问题答案
         """
-        if context:
-            prompt = f"""基于以下上下文回答技术问题：
-
-上下文：
-{context}
-
-问题：
-{question}
-
-要求：
-1. 准确回答核心问题
-2. 提供相关公式或规范引用
-3. 给出实际应用建议
-4. 如有不确定请说明"""
-        else:
-            prompt = f"""请回答以下风荷载计算相关技术问题：
+        return self._run("qa_context" if context else "qa", question=question, context=context)
+    
+    async def aquery_many(self, prompts: List[str], max_concurrency: int = 32, **kwargs) -> List[Any]:
+        """
+        并发查询多个提示
+        
+        提示按长度分桶，各桶由短到长依次并发发出，max_length按桶上限收紧。
+        
+        参数:
+            prompts: 提示文本列表
+            max_concurrency: 最大并发请求数
+            **kwargs: 额外参数，同query
+            
+        返回:
+            与prompts顺序一致的API响应列表；单个请求抛出的异常作为对应位置的结果返回
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def query_one(prompt, bucket_kwargs):
+            async with semaphore:
+                return await self.aquery(prompt, **bucket_kwargs)
+        
+        # 按长度分桶并保留原始下标，短提示不与长提示混在同一波中
+        buckets: Dict[int, List[int]] = {}
+        for index, prompt in enumerate(prompts):
+            size = len(prompt)
+            bucket = next((b for b in LENGTH_BUCKETS if size <= b), LENGTH_BUCKETS[-1])
+            buckets.setdefault(bucket, []).append(index)
+        
+        results: List[Any] = [None] * len(prompts)
+        for bucket in sorted(buckets):
+            indices = buckets[bucket]
+            # 短提示无需请求过长的生成结果
+            max_length = min(bucket * 2, BUCKET_MAX_LENGTH, kwargs.get("max_length", BUCKET_MAX_LENGTH))
+            bucket_kwargs = {**kwargs, "max_length": max_length}
+            wave = await asyncio.gather(
+                *(query_one(prompts[i], bucket_kwargs) for i in indices),
+                return_exceptions=True
+            )
+            for i, result in zip(indices, wave):
+                results[i] = result
+        
+        return results
+    
+    def query_many(self, prompts: List[str], max_concurrency: int = 32, **kwargs) -> List[Any]:
+        """aquery_many 的同步版本"""
+        return asyncio.run(self.aquery_many(prompts, max_concurrency, **kwargs))
 
-问题：
-{question}
+    async def a_generate_documentation(self, code_content: str, doc_type: str = "function") -> str:
+        """generate_documentation 的异步版本"""
+        return await self._arun("doc", doc_type=doc_type, code_content=code_content)
+    
+    async def a_explain_concept(self, concept: str, context: str = "风荷载计算") -> str:
+        """explain_concept 的异步版本"""
+        return await self._arun("concept", concept=concept, context=context)
+    
+    async def a_generate_calculation_report(self,
+                                            building_params: Dict[str, Any],
+                                            results: Dict[str, Any],
+                                            code_standard: str = "GB50009") -> str:
+        """generate_calculation_report 的异步版本"""
+        return await self._arun(
+            "report",
+            building_params=_dumps_pretty(building_params),
+            results=_dumps_pretty(results),
+            code_standard=code_standard
+        )
+    
+    async def a_answer_technical_question(self, question: str, context: str = "") -> str:
+        """answer_technical_question 的异步版本"""
+        return await self._arun("qa_context" if context else "qa", question=question, context=context)
 
-要求：
-1. 专业准确的回答
-2. 引用相关规范
-3. 提供计算思路
-4. 工程应用建议"""
+class HFBatcher:
+    """请求合并器：把短时间内到达的多个提示合并为一次以列表为inputs的API调用"""
+    
+    def __init__(self, client: HuggingFaceAI,
+                 max_batch_size: int = MAX_BATCH_SIZE,
+                 max_batch_delay: float = MAX_BATCH_DELAY):
+        """
+        初始化请求合并器（需在事件循环中创建）
         
-        result = self.query(prompt, max_length=800)
+        参数:
+            client: 发送请求的HuggingFaceAI实例
+            max_batch_size: 单次API调用合并的最多提示数
+            max_batch_delay: 等待凑批的最长时间（秒）
+        """
+        self.client = client
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        # 进行中的发送任务，保留引用以免被回收
+        self._sending: set = set()
+    
+    async def submit(self, params: Dict[str, Any]) -> Any:
+        """
+        提交单个请求并等待其结果
         
-        if isinstance(result, list) and len(result) > 0:
-            return result[0].get("generated_text", "回答生成失败")
-        elif isinstance(result, dict) and "generated_text" in result:
-            return result["generated_text"]
-        else:
-            return str(result)
+        参数:
+            params: _build_params 构建的请求参数
+            
+        返回:
+            该提示对应的API响应，形式与query一致
+        """
+        # 入队前计算分组键，参数无法序列化时直接向调用方抛出，不影响后台任务
+        group_key = _dumps_payload([params["parameters"], params["options"]])
+        
+        # 后台任务未启动或已意外结束时重新启动
+        if self._task is None or self._task.done():
+            self._task = self.loop.create_task(self._run())
+        
+        future = self.loop.create_future()
+        await self._queue.put((group_key, params, future))
+        return await future
+    
+    def stop(self):
+        """停止后台合并任务，尚未发送的请求以 HFAPIError 结束"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        
+        error = HFAPIError("请求合并器已停止")
+        while not self._queue.empty():
+            _, _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(error)
+    
+    async def _run(self):
+        """后台任务：凑批后按生成参数分组发送"""
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self.loop.time() + self.max_batch_delay
+            try:
+                while len(batch) < self.max_batch_size:
+                    timeout = deadline - self.loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                # 凑批期间被停止，已取出的请求同样以错误结束
+                error = HFAPIError("请求合并器已停止")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                raise
+            
+            # 只有生成参数和选项完全相同的请求才能合并到同一次调用
+            groups: Dict[bytes, List[tuple]] = {}
+            for group_key, params, future in batch:
+                groups.setdefault(group_key, []).append((params, future))
+            
+            for items in groups.values():
+                task = self.loop.create_task(self._send(items))
+                self._sending.add(task)
+                task.add_done_callback(self._sending.discard)
+    
+    async def _send(self, items: List[tuple]):
+        """发送一组请求并把结果按顺序分发给等待者；任何异常都传给该组的所有等待者"""
+        try:
+            first = items[0][0]
+            if len(items) == 1:
+                payload = first
+            else:
+                payload = {
+                    "inputs": [params["inputs"] for params, _ in items],
+                    "parameters": first["parameters"],
+                    "options": first["options"]
+                }
+            
+            result = await self.client._apost(payload)
+            if len(items) == 1:
+                results = [result]
+            elif isinstance(result, list) and len(result) == len(items):
+                # 单个输入的结果可能是字典，统一为与query一致的列表形式
+                results = [r if isinstance(r, list) else [r] for r in result]
+            else:
+                raise HFAPIError(f"批量响应与请求数量不一致: {str(result)[:200]}")
+        except Exception as e:
+            logger.error("%s", e)
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (_, future), result in zip(items, results):
+            if not future.done():
+                future.set_result(result)
 
 # 使用示例
-def main():
+async def main():
     """使用示例"""
     # 从环境变量获取API Token
     hf_token = os.getenv("HF_TOKEN")
@@ -242,7 +1037,7 @@ def main():
         return
     
     # 创建AI助手实例
-    ai = HuggingFaceAI(api_token=hf_token)
+    ai = HuggingFaceAI.default(api_token=hf_token)
     
     # 示例1：生成文档
     sample_code = """
@@ -254,21 +1049,28 @@ def calculate_wind_pressure(height, terrain_category, location):
     pass
     """
     
+    # 三个示例相互独立，并发请求
+    docs, explanation, answer = await asyncio.gather(
+        ai.a_generate_documentation(sample_code),
+        ai.a_explain_concept("基本风压", "建筑结构荷载"),
+        ai.a_answer_technical_question("GB50009中地面粗糙度类别如何确定？"),
+        return_exceptions=True
+    )
+    
     print("示例1：生成代码文档")
-    docs = ai.generate_documentation(sample_code, "function")
-    print(docs)
+    print(f"生成文档失败: {docs}" if isinstance(docs, Exception) else docs)
     print("-" * 50)
     
     # 示例2：解释概念
     print("示例2：解释技术概念")
-    explanation = ai.explain_concept("基本风压", "建筑结构荷载")
-    print(explanation)
+    print(f"解释生成失败: {explanation}" if isinstance(explanation, Exception) else explanation)
     print("-" * 50)
     
     # 示例3：回答技术问题
     print("示例3：回答技术问题")
-    answer = ai.answer_technical_question("GB50009中地面粗糙度类别如何确定？")
-    print(answer)
+    print(f"回答生成失败: {answer}" if isinstance(answer, Exception) else answer)
+    
+    await ai.aclose()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
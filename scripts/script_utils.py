@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+脚本公共工具
+AI审查、文档生成和计算示例脚本共用的文件查找、JSON写入、缓存清理和日志输出
+"""
+
+import os
+import json
+import threading
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，未安装时使用标准库json
+    orjson = None
+
+# 查找Python文件时跳过的目录
+SKIP_DIRS = {".git", "__pycache__", ".cache", "venv", ".venv", "node_modules"}
+
+_print_lock = threading.Lock()
+
+def log(message):
+    """线程安全的进度输出"""
+    with _print_lock:
+        print(message)
+
+def find_python_files(directory="src"):
+    """查找Python文件"""
+    return list(iter_python_files(directory))
+
+def iter_python_files(directory="src"):
+    """逐个产出Python文件路径，跳过无关目录"""
+    subdirs = []
+    
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in SKIP_DIRS:
+                        subdirs.append(entry.path)
+                elif entry.name.endswith(".py") and entry.is_file(follow_symlinks=False):
+                    yield Path(entry.path)
+    except OSError:
+        return
+    
+    for subdir in subdirs:
+        yield from iter_python_files(subdir)
+
+def write_json(path, data, indent=True):
+    """写入JSON文件，安装了orjson时使用orjson加速序列化"""
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 if indent else 0
+        Path(path).write_bytes(orjson.dumps(data, option=option))
+        return
+    
+    with open(path, 'w', encoding='utf-8') as f:
+        if indent:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        else:
+            json.dump(data, f, ensure_ascii=False)
+
+def prune_cache_dir(cache_dir, used_keys):
+    """删除缓存目录中本次运行未用到的条目，避免缓存无限增长"""
+    try:
+        entries = list(cache_dir.iterdir())
+    except OSError:
+        return
+    
+    for entry in entries:
+        if entry.stem not in used_keys:
+            entry.unlink(missing_ok=True)